@@ -3,42 +3,67 @@
 Google Gemini Image Generation Script with ImageKit Upload
 
 This script generates images using Google's Gemini API and uploads them to ImageKit.
-It accepts a prompt and returns the ImageKit URL.
+It accepts a prompt (or a batch of prompts) and returns the ImageKit URL(s).
 
 Usage:
     python generate_image.py --prompt "your prompt here" --variation "A"
-    
+    python generate_image.py --prompts-json '[{"prompt": "...", "variation_id": "A"}, {"prompt": "...", "variation_id": "B"}]'
+    python generate_image.py --serve < jobs.jsonl
+    python generate_image.py --prompt "..." --cache-file prompt_cache.json
+
 Environment Variables:
     GOOGLE_API_KEY: Google Gemini API key (required)
     IMAGEKIT_PRIVATE_KEY: ImageKit private key (required)
-    IMAGEKIT_PUBLIC_KEY: ImageKit public key (required)
-    IMAGEKIT_URL_ENDPOINT: ImageKit URL endpoint (required)
+    IMAGEKIT_PUBLIC_KEY: ImageKit public key (optional, unused by REST uploads)
+    IMAGEKIT_URL_ENDPOINT: ImageKit URL endpoint (optional, unused by REST uploads)
 """
 
 import argparse
-import base64
+import asyncio
+import functools
 import json
 import logging
+import math
 import os
+import pathlib
+import secrets
 import sys
-import uuid
-from typing import Dict, Optional, Tuple
+import tempfile
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
 
-try:
+if TYPE_CHECKING:
     from google import genai
-    from google.genai import types
+
+try:
+    import httpx
+except ImportError:
+    print(json.dumps({
+        "error": "httpx package not installed. Run: pip install httpx",
+        "success": False
+    }))
+    sys.exit(1)
+
+try:
+    import orjson
 except ImportError:
     print(json.dumps({
-        "error": "google-genai package not installed. Run: pip install google-genai>=1.32.0",
+        "error": "orjson package not installed. Run: pip install orjson",
         "success": False
     }))
     sys.exit(1)
 
 try:
-    from imagekitio import ImageKit
+    from tenacity import (
+        before_sleep_log,
+        retry,
+        retry_if_exception,
+        stop_after_attempt,
+        wait_exponential_jitter,
+    )
 except ImportError:
     print(json.dumps({
-        "error": "imagekitio package not installed. Run: pip install imagekitio",
+        "error": "tenacity package not installed. Run: pip install tenacity",
         "success": False
     }))
     sys.exit(1)
@@ -50,6 +75,82 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+IMAGEKIT_UPLOAD_URL = "https://upload.imagekit.io/api/v1/files/upload"
+IMAGEKIT_MAX_CONNECTIONS = 8
+
+# Gemini status codes worth retrying; auth and other client errors fail fast
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+MAX_RETRY_AFTER_SECONDS = 60.0
+
+# Embedding model and default cosine similarity for the approximate prompt cache
+EMBEDDING_MODEL = "gemini-embedding-001"
+DEFAULT_CACHE_THRESHOLD = 0.92
+# Request settings a cache hit must match exactly, besides prompt similarity
+CACHE_SCOPE_KEYS = ("model", "aspect_ratio", "campaign_id", "output_mime_type", "embedding_model")
+CACHE_ENTRY_KEYS = frozenset({"embedding", "upload", *CACHE_SCOPE_KEYS})
+CACHE_UPLOAD_KEYS = frozenset({"image_url", "file_id", "mime_type"})
+
+# Per-job keys in --serve mode that override the matching CLI defaults
+JOB_OPTIONS = ("model", "aspect_ratio", "campaign_id", "concurrency")
+
+ASPECT_RATIOS = ("1:1", "3:4", "4:3", "9:16", "16:9")
+
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Credentials read from the environment once at startup"""
+    google_api_key: Optional[str]
+    imagekit_private_key: Optional[str]
+    imagekit_public_key: Optional[str]
+    imagekit_url_endpoint: Optional[str]
+    
+    @classmethod
+    def from_env(cls) -> "Config":
+        return cls(
+            google_api_key=os.getenv('GOOGLE_API_KEY'),
+            imagekit_private_key=os.getenv('IMAGEKIT_PRIVATE_KEY'),
+            imagekit_public_key=os.getenv('IMAGEKIT_PUBLIC_KEY'),
+            imagekit_url_endpoint=os.getenv('IMAGEKIT_URL_ENDPOINT'),
+        )
+
+
+CONFIG = Config.from_env()
+
+
+@functools.lru_cache(maxsize=1)
+def _genai():
+    """
+    Import google-genai on first use
+    
+    The SDK takes hundreds of milliseconds to import, so --help and
+    argument errors should not pay for it up front.
+    """
+    try:
+        # Importing the submodules is what exposes genai.errors and genai.types
+        import google.genai.errors
+        import google.genai.types
+    except ImportError:
+        raise ImportError(
+            "google-genai package not installed. Run: pip install google-genai>=1.51.0"
+        ) from None
+    return google.genai
+
+
+@functools.lru_cache(maxsize=1)
+def _get_gemini_client(api_key: str) -> "genai.Client":
+    """Return the process-wide Gemini client so its connection pool is reused"""
+    return _genai().Client(api_key=api_key)
+
+
+def _new_async_imagekit_client() -> "httpx.AsyncClient":
+    """Create an async ImageKit HTTP client; it is bound to the running event loop"""
+    # HTTP/2 lets concurrent uploads share one TLS session as separate streams
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=60.0,
+        limits=httpx.Limits(max_keepalive_connections=IMAGEKIT_MAX_CONNECTIONS),
+    )
+
 
 class ImageKitUploader:
     """Handles uploading images to ImageKit"""
@@ -60,80 +161,100 @@ class ImageKitUploader:
         public_key: Optional[str] = None,
         url_endpoint: Optional[str] = None
     ):
-        self.private_key = private_key or os.getenv('IMAGEKIT_PRIVATE_KEY')
-        self.public_key = public_key or os.getenv('IMAGEKIT_PUBLIC_KEY')
-        self.url_endpoint = url_endpoint or os.getenv('IMAGEKIT_URL_ENDPOINT')
+        self.private_key = private_key or CONFIG.imagekit_private_key
+        self.public_key = public_key or CONFIG.imagekit_public_key
+        self.url_endpoint = url_endpoint or CONFIG.imagekit_url_endpoint
         
-        if not all([self.private_key, self.public_key, self.url_endpoint]):
+        # The REST upload API authenticates with the private key alone
+        if not self.private_key:
             raise ValueError(
-                "ImageKit credentials not found. Set IMAGEKIT_PRIVATE_KEY, "
-                "IMAGEKIT_PUBLIC_KEY, and IMAGEKIT_URL_ENDPOINT environment variables"
+                "ImageKit credentials not found. Set IMAGEKIT_PRIVATE_KEY environment variable"
             )
         
-        self._client = ImageKit(
-            private_key=self.private_key,
-            public_key=self.public_key,
-            url_endpoint=self.url_endpoint
-        )
-        logger.info("ImageKit client initialized successfully")
+        logger.info("ImageKit uploader initialized successfully")
     
-    def upload(self, image_bytes: bytes, filename: str, folder: str = "ad-images") -> Dict:
+    async def upload_async(
+        self,
+        client: "httpx.AsyncClient",
+        image_bytes: bytes,
+        filename: str,
+        folder: str = "ad-images",
+        mime_type: str = "image/png"
+    ) -> Dict:
         """
-        Upload image bytes to ImageKit
+        Upload image bytes to ImageKit through the REST upload API
         
         Args:
+            client: Shared async HTTP client
             image_bytes: Raw image bytes
             filename: Name for the uploaded file
             folder: ImageKit folder path
+            mime_type: MIME type of the image bytes
             
         Returns:
             Dict with url, file_id, and other metadata
         """
-        from imagekitio.models.UploadFileRequestOptions import UploadFileRequestOptions
-        
-        # Convert bytes to base64 for upload
-        image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-        
-        result = self._client.upload_file(
-            file=image_base64,
-            file_name=filename,
-            options=UploadFileRequestOptions(
-                folder=folder,
-                use_unique_file_name=True,
-            )
+        # Raw bytes go straight into the multipart body; no base64 round-trip
+        response = await client.post(
+            IMAGEKIT_UPLOAD_URL,
+            auth=(self.private_key, ""),
+            files={"file": (filename, image_bytes, mime_type)},
+            data={
+                "fileName": filename,
+                "folder": folder,
+                "useUniqueFileName": "true",
+            },
         )
+        if response.status_code != 200:
+            raise Exception(f"ImageKit upload failed ({response.status_code}): {response.text}")
         
-        # Access the raw response dict from response_metadata
-        # Result is UploadFileResult object, raw data is in response_metadata.raw
-        if hasattr(result, 'response_metadata') and hasattr(result.response_metadata, 'raw'):
-            raw = result.response_metadata.raw
-            if isinstance(raw, dict) and 'url' in raw:
-                logger.info(f"Image uploaded successfully: {raw['url']}")
-                return {
-                    "url": raw.get('url'),
-                    "file_id": raw.get('fileId'),
-                    "name": raw.get('name', filename),
-                    "thumbnail_url": raw.get('thumbnailUrl')
-                }
-        
-        # Fallback: try direct attribute access on result object
-        if hasattr(result, 'url') and result.url:
-            logger.info(f"Image uploaded successfully: {result.url}")
-            return {
-                "url": result.url,
-                "file_id": getattr(result, 'file_id', None),
-                "name": getattr(result, 'name', filename),
-                "thumbnail_url": getattr(result, 'thumbnail_url', None)
-            }
+        raw = response.json()
+        if not isinstance(raw, dict) or 'url' not in raw:
+            raise Exception(f"ImageKit upload failed or unexpected response: {raw}")
         
-        raise Exception(f"ImageKit upload failed or unexpected response: {result}")
+        logger.info(f"Image uploaded successfully: {raw['url']}")
+        return {
+            "url": raw.get('url'),
+            "file_id": raw.get('fileId'),
+            "name": raw.get('name', filename),
+            "thumbnail_url": raw.get('thumbnailUrl')
+        }
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    return isinstance(exc, _genai().errors.APIError) and exc.code in RETRYABLE_STATUS_CODES
+
+
+_backoff = wait_exponential_jitter(initial=1, max=16)
+
+
+def _wait_before_retry(retry_state) -> float:
+    """Honour a Retry-After header when the API sends one, else back off with jitter"""
+    exc = retry_state.outcome.exception()
+    headers = getattr(getattr(exc, 'response', None), 'headers', None)
+    retry_after = headers.get('retry-after') if headers else None
+    if retry_after:
+        try:
+            return min(max(float(retry_after), 0.0), MAX_RETRY_AFTER_SECONDS)
+        except ValueError:
+            pass  # HTTP-date form; fall back to exponential backoff
+    return _backoff(retry_state)
+
+
+gemini_retry = retry(
+    retry=retry_if_exception(_is_retryable),
+    wait=_wait_before_retry,
+    stop=stop_after_attempt(5),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True,
+)
 
 
 class GeminiImageGenerator:
     """Handles image generation using Google Gemini API"""
     
-    def __init__(self, api_key: Optional[str] = None):
-        self.api_key = api_key or os.getenv('GOOGLE_API_KEY')
+    def __init__(self, api_key: Optional[str] = None, output_mime_type: Optional[str] = None):
+        self.api_key = api_key or CONFIG.google_api_key
         
         if not self.api_key:
             raise ValueError(
@@ -141,40 +262,569 @@ class GeminiImageGenerator:
                 "or pass api_key parameter"
             )
         
-        os.environ['GOOGLE_API_KEY'] = self.api_key
-        self._client = genai.Client()
+        self._client = _get_gemini_client(self.api_key)
+        
+        # Only Vertex AI honours output_mime_type; the Developer API rejects it
+        self.output_mime_type = output_mime_type
+        if output_mime_type and not self._client.vertexai:
+            logger.warning(
+                f"Ignoring output MIME type {output_mime_type}: only supported on Vertex AI"
+            )
+            self.output_mime_type = None
         logger.info("Gemini client initialized successfully")
     
-    def generate_image(
+    def _build_config(self, aspect_ratio: str) -> "genai.types.GenerateContentConfig":
+        types = _genai().types
+        image_options = {"aspect_ratio": aspect_ratio}
+        if self.output_mime_type:
+            image_options["output_mime_type"] = self.output_mime_type
+        return types.GenerateContentConfig(
+            response_modalities=["IMAGE"],
+            image_config=types.ImageConfig(**image_options),
+        )
+    
+    def _extract_image(self, response) -> Tuple[bytes, str]:
+        parts = response.parts or []
+        if logger.isEnabledFor(logging.DEBUG):
+            for part in parts:
+                if part.text is not None:
+                    logger.debug(f"Generated text: {part.text}")
+        
+        part = next((p for p in parts if p.inline_data is not None), None)
+        if part is None:
+            raise Exception("No image data found in Gemini response")
+        
+        image_bytes = part.inline_data.data
+        mime_type = part.inline_data.mime_type or self.output_mime_type or 'image/png'
+        logger.info(f"Image generated successfully: {mime_type}, {len(image_bytes)} bytes")
+        return image_bytes, mime_type
+    
+    @gemini_retry
+    async def generate_image_async(
         self,
         prompt: str,
         model: str = "gemini-2.5-flash-image",
         aspect_ratio: str = "1:1"
     ) -> Tuple[bytes, str]:
-        """Generate an image from a text prompt"""
+        """Generate an image from a text prompt using the async client"""
         logger.info(f"Generating image with prompt: {prompt[:100]}...")
         
-        response = self._client.models.generate_content(
+        response = await self._client.aio.models.generate_content(
             model=model,
             contents=[prompt],
-            config=types.GenerateContentConfig(
-                response_modalities=["IMAGE"],
-                image_config=types.ImageConfig(
-                    aspect_ratio=aspect_ratio,
-                ),
-            ),
+            config=self._build_config(aspect_ratio),
         )
+        return self._extract_image(response)
+    
+    async def generate_many(
+        self,
+        prompts: List[Tuple[str, str]],
+        model: str = "gemini-2.5-flash-image",
+        aspect_ratio: str = "1:1",
+        concurrency: int = 2,
+        queue: Optional["asyncio.Queue"] = None,
+        semaphore: Optional["asyncio.Semaphore"] = None
+    ) -> List[Union[Tuple[bytes, str], BaseException]]:
+        """
+        Generate images for several prompts concurrently
+        
+        Args:
+            prompts: List of (prompt, variation_id) pairs
+            model: Gemini model to use
+            aspect_ratio: Aspect ratio applied to every image
+            concurrency: Maximum number of in-flight Gemini requests
+            queue: Optional queue that receives (index, outcome) as soon as
+                each variation finishes, so consumers can start early
+            semaphore: Optional semaphore shared with other calls, capping
+                in-flight Gemini requests across all of them; when given,
+                concurrency is ignored
+            
+        Returns:
+            One entry per prompt, in input order: either (image_bytes, mime_type)
+            or the exception raised while generating that variation
+        """
+        sem = semaphore if semaphore is not None else asyncio.Semaphore(concurrency)
         
-        for part in response.parts:
-            if part.text is not None:
-                logger.info(f"Generated text: {part.text}")
-            elif part.inline_data is not None:
-                image_bytes = part.inline_data.data
-                mime_type = part.inline_data.mime_type or 'image/png'
-                logger.info(f"Image generated successfully: {mime_type}, {len(image_bytes)} bytes")
-                return image_bytes, mime_type
+        async def _generate(index: int, prompt: str, variation_id: str) -> Tuple[bytes, str]:
+            try:
+                async with sem:
+                    logger.info(f"Generating variation {variation_id}")
+                    outcome = await self.generate_image_async(prompt, model, aspect_ratio)
+            except Exception as e:
+                outcome = e
+            if queue is not None:
+                await queue.put((index, outcome))
+            if isinstance(outcome, BaseException):
+                raise outcome
+            return outcome
         
-        raise Exception("No image data found in Gemini response")
+        return await asyncio.gather(
+            *(_generate(index, prompt, variation_id)
+              for index, (prompt, variation_id) in enumerate(prompts)),
+            return_exceptions=True
+        )
+
+
+class PromptCache:
+    """
+    Approximate cache mapping prompt embeddings to previously uploaded images
+    
+    Entries are kept in a small JSON file. Lookups are a linear cosine scan
+    over unit-normalised embeddings, which is cheap at the scale of one
+    campaign's prompt history.
+    """
+    
+    def __init__(
+        self,
+        path: str,
+        client: "genai.Client",
+        threshold: float = DEFAULT_CACHE_THRESHOLD,
+        embedding_model: str = EMBEDDING_MODEL
+    ):
+        self.path = pathlib.Path(path)
+        self.threshold = threshold
+        self.embedding_model = embedding_model
+        self._client = client
+        self._entries: List[Dict] = []
+        
+        if self.path.exists():
+            try:
+                entries = orjson.loads(self.path.read_bytes())
+                if not self._is_valid(entries):
+                    raise ValueError("expected a list of cache entries")
+                self._entries = entries
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable prompt cache {self.path}: {e}")
+        logger.info(f"Prompt cache loaded with {len(self._entries)} entries")
+    
+    @staticmethod
+    def _is_valid(entries) -> bool:
+        return isinstance(entries, list) and all(
+            isinstance(entry, dict)
+            and CACHE_ENTRY_KEYS <= entry.keys()
+            and isinstance(entry["embedding"], list)
+            and len(entry["embedding"]) > 0
+            and all(
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                for value in entry["embedding"]
+            )
+            and isinstance(entry["upload"], dict)
+            and CACHE_UPLOAD_KEYS <= entry["upload"].keys()
+            for entry in entries
+        )
+    
+    async def embed(self, prompt: str) -> List[float]:
+        """Return the unit-normalised embedding for a prompt"""
+        response = await self._client.aio.models.embed_content(
+            model=self.embedding_model,
+            contents=prompt,
+        )
+        values = response.embeddings[0].values
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+    
+    def lookup(self, embedding: List[float], scope: Dict) -> Optional[Dict]:
+        """
+        Return the closest cached entry at or above the similarity threshold
+        
+        Only entries whose CACHE_SCOPE_KEYS all equal scope are considered.
+        """
+        best, best_score = None, self.threshold
+        for entry in self._entries:
+            if any(entry[key] != scope[key] for key in CACHE_SCOPE_KEYS):
+                continue
+            # Guard against silently truncated dot products via zip()
+            if len(entry["embedding"]) != len(embedding):
+                continue
+            score = sum(a * b for a, b in zip(embedding, entry["embedding"]))
+            if score >= best_score:
+                best, best_score = entry, score
+        
+        if best is None:
+            return None
+        logger.info(f"Prompt cache hit (similarity {best_score:.3f}): {best['upload']['image_url']}")
+        return best
+    
+    def store(self, embedding: List[float], scope: Dict, prompt: str, result: Dict) -> None:
+        """Record an uploaded image and its source prompt under the given scope and persist the cache"""
+        self._entries.append({
+            "embedding": embedding,
+            "prompt": prompt,
+            **{key: scope[key] for key in CACHE_SCOPE_KEYS},
+            "upload": {
+                "image_url": result["image_url"],
+                "thumbnail_url": result.get("thumbnail_url"),
+                "file_id": result["file_id"],
+                "mime_type": result["mime_type"],
+            },
+        })
+        
+        # Write to a uniquely named temp file and swap it in, so a crash never
+        # truncates the cache and concurrent processes never share a temp path
+        with tempfile.NamedTemporaryFile(
+            dir=self.path.parent,
+            prefix=f"{self.path.name}.",
+            suffix=".tmp",
+            delete=False
+        ) as tmp_file:
+            tmp_path = tmp_file.name
+            try:
+                tmp_file.write(orjson.dumps(self._entries))
+            except BaseException:
+                tmp_file.close()
+                os.unlink(tmp_path)
+                raise
+        try:
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def emit(output: Dict, indent: bool = False) -> None:
+    """Write one JSON document to stdout, newline-terminated"""
+    option = orjson.OPT_APPEND_NEWLINE | (orjson.OPT_INDENT_2 if indent else 0)
+    sys.stdout.buffer.write(orjson.dumps(output, option=option))
+    sys.stdout.flush()
+
+
+def positive_int(value: str) -> int:
+    """argparse type for counts that must be at least 1"""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value!r}") from None
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+def validate_job_options(overrides: Dict, max_concurrency: int) -> None:
+    """Reject --serve job overrides that would fail, stall or exceed the process limits"""
+    for key in ("model", "campaign_id"):
+        if key in overrides and not (isinstance(overrides[key], str) and overrides[key]):
+            raise ValueError(f"Job option '{key}' must be a non-empty string")
+    if "aspect_ratio" in overrides and overrides["aspect_ratio"] not in ASPECT_RATIOS:
+        raise ValueError(f"Job option 'aspect_ratio' must be one of {', '.join(ASPECT_RATIOS)}")
+    if "concurrency" in overrides:
+        concurrency = overrides["concurrency"]
+        # bool is an int subclass, but true/false is never a meaningful count
+        if not isinstance(concurrency, int) or isinstance(concurrency, bool) or concurrency < 1:
+            raise ValueError("Job option 'concurrency' must be an integer of at least 1")
+        if concurrency > max_concurrency:
+            raise ValueError(
+                f"Job option 'concurrency' must not exceed --concurrency ({max_concurrency})"
+            )
+
+
+def parse_prompt_entries(entries) -> List[Tuple[str, str]]:
+    """Build (prompt, variation_id) pairs from a list of {prompt, variation_id} objects"""
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("prompts must be a non-empty JSON array")
+    
+    prompts = []
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("prompt"):
+            raise ValueError(f"prompts entry {index} must be an object with a 'prompt' field")
+        variation_id = str(entry.get("variation_id") or chr(ord("A") + index))
+        prompts.append((entry["prompt"], variation_id))
+    return prompts
+
+
+def load_prompts(args: argparse.Namespace) -> List[Tuple[str, str]]:
+    """Build the list of (prompt, variation_id) pairs from CLI arguments"""
+    if args.prompts_json is None:
+        return [(args.prompt, args.variation)]
+    return parse_prompt_entries(json.loads(args.prompts_json))
+
+
+def format_output(results: List[Dict], batch: bool) -> Dict:
+    """Shape per-variation results into the script's JSON output"""
+    if not batch:
+        return results[0]
+    return {
+        "success": all(result["success"] for result in results),
+        "variations": results
+    }
+
+
+async def producer(
+    generator: GeminiImageGenerator,
+    queue: "asyncio.Queue",
+    prompts: List[Tuple[str, str]],
+    args: argparse.Namespace,
+    semaphore: Optional["asyncio.Semaphore"] = None
+) -> None:
+    """Generate all variations, pushing each onto the queue as it completes"""
+    try:
+        await generator.generate_many(
+            prompts,
+            model=args.model,
+            aspect_ratio=args.aspect_ratio,
+            concurrency=args.concurrency,
+            queue=queue,
+            semaphore=semaphore
+        )
+    finally:
+        # One sentinel per consumer signals that production is done
+        for _ in range(args.concurrency):
+            await queue.put(None)
+
+
+async def consumer(
+    uploader: ImageKitUploader,
+    client: "httpx.AsyncClient",
+    queue: "asyncio.Queue",
+    jobs: List[Tuple[str, str, str]],
+    results: List[Optional[Dict]],
+    folder: str
+) -> None:
+    """
+    Drain generated images from the queue and upload them to ImageKit
+    
+    jobs holds (prompt, variation_id, filename_stem) per queue index; the
+    extension is appended once the image's MIME type is known.
+    """
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        
+        index, outcome = item
+        prompt, variation_id, filename_stem = jobs[index]
+        try:
+            if isinstance(outcome, BaseException):
+                raise outcome
+            image_bytes, mime_type = outcome
+            
+            ext = "png" if "png" in mime_type else "jpg"
+            filename = f"{filename_stem}.{ext}"
+            
+            upload_result = await uploader.upload_async(client, image_bytes, filename, folder, mime_type)
+            results[index] = {
+                "success": True,
+                "variation_id": variation_id,
+                "image_url": upload_result["url"],
+                "thumbnail_url": upload_result.get("thumbnail_url"),
+                "file_id": upload_result["file_id"],
+                "mime_type": mime_type,
+                "prompt_used": prompt
+            }
+        except Exception as e:
+            logger.error(f"Variation {variation_id} failed: {e}")
+            results[index] = {
+                "success": False,
+                "error": str(e),
+                "variation_id": variation_id
+            }
+
+
+def cache_scope(
+    generator: GeminiImageGenerator,
+    cache: PromptCache,
+    args: argparse.Namespace
+) -> Dict:
+    """Settings that decide whether a cached upload can stand in for a new image"""
+    return {
+        "model": args.model,
+        "aspect_ratio": args.aspect_ratio,
+        "campaign_id": args.campaign_id,
+        "output_mime_type": generator.output_mime_type,
+        # Vectors from different embedding models are not comparable
+        "embedding_model": cache.embedding_model,
+    }
+
+
+async def lookup_cache(
+    cache: PromptCache,
+    prompts: List[Tuple[str, str]],
+    scope: Dict
+) -> Tuple[List[Optional[List[float]]], List[Optional[Dict]]]:
+    """
+    Embed every prompt and resolve cache hits
+    
+    Returns:
+        (embeddings, results) aligned with prompts. An embedding is None if
+        embedding failed; a result is None on a cache miss.
+    """
+    outcomes = await asyncio.gather(
+        *(cache.embed(prompt) for prompt, _ in prompts),
+        return_exceptions=True
+    )
+    
+    embeddings: List[Optional[List[float]]] = []
+    results: List[Optional[Dict]] = []
+    for (prompt, variation_id), outcome in zip(prompts, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.warning(f"Prompt embedding failed for variation {variation_id}: {outcome}")
+            embeddings.append(None)
+            results.append(None)
+            continue
+        
+        embeddings.append(outcome)
+        hit = cache.lookup(outcome, scope)
+        results.append(None if hit is None else {
+            "success": True,
+            "variation_id": variation_id,
+            **hit["upload"],
+            # The image was generated from the cached prompt, not the requested
+            # one; entries written before prompts were stored report None
+            "prompt_used": hit.get("prompt"),
+            "requested_prompt": prompt,
+            "cached": True
+        })
+    return embeddings, results
+
+
+async def run(
+    generator: GeminiImageGenerator,
+    uploader: ImageKitUploader,
+    client: "httpx.AsyncClient",
+    prompts: List[Tuple[str, str]],
+    args: argparse.Namespace,
+    cache: Optional[PromptCache] = None,
+    semaphore: Optional["asyncio.Semaphore"] = None
+) -> List[Dict]:
+    """
+    Generate and upload all variations, overlapping uploads with generation
+    
+    Pass a shared semaphore to cap Gemini requests across concurrent runs;
+    otherwise this run is limited to args.concurrency on its own.
+    """
+    results: List[Optional[Dict]] = [None] * len(prompts)
+    embeddings: List[Optional[List[float]]] = [None] * len(prompts)
+    if cache is not None:
+        scope = cache_scope(generator, cache, args)
+        embeddings, results = await lookup_cache(cache, prompts, scope)
+    
+    # Only cache misses go through generation and upload
+    pending = [index for index, result in enumerate(results) if result is None]
+    pending_prompts = [prompts[index] for index in pending]
+    pending_results: List[Optional[Dict]] = [None] * len(pending)
+    
+    if pending:
+        # Build unique filenames and the folder up front so consumers only upload
+        folder = f"ad-images/{args.campaign_id}"
+        jobs = [
+            (prompt, variation_id, f"ad_{args.campaign_id}_{variation_id}_{secrets.token_hex(4)}")
+            for prompt, variation_id in pending_prompts
+        ]
+        
+        queue: asyncio.Queue = asyncio.Queue()
+        await asyncio.gather(
+            producer(generator, queue, pending_prompts, args, semaphore),
+            *(consumer(uploader, client, queue, jobs, pending_results, folder)
+              for _ in range(args.concurrency))
+        )
+    
+    for index, result in zip(pending, pending_results):
+        results[index] = result
+        if cache is not None and embeddings[index] is not None and result["success"]:
+            # The image is already uploaded; a cache write failure must not hide it
+            try:
+                cache.store(embeddings[index], scope, prompts[index][0], result)
+            except Exception as e:
+                logger.warning(f"Failed to save prompt cache {cache.path}: {e}")
+    return results
+
+
+async def run_once(
+    generator: GeminiImageGenerator,
+    uploader: ImageKitUploader,
+    prompts: List[Tuple[str, str]],
+    args: argparse.Namespace,
+    cache: Optional[PromptCache] = None
+) -> List[Dict]:
+    """Run a single batch of prompts with a short-lived async HTTP client"""
+    async with _new_async_imagekit_client() as client:
+        return await run(generator, uploader, client, prompts, args, cache)
+
+
+async def handle_job(
+    generator: GeminiImageGenerator,
+    uploader: ImageKitUploader,
+    client: "httpx.AsyncClient",
+    line: str,
+    args: argparse.Namespace,
+    cache: Optional[PromptCache] = None,
+    semaphore: Optional["asyncio.Semaphore"] = None
+) -> Dict:
+    """
+    Run one --serve job
+    
+    A job is a JSON object with either "prompt" (plus optional "variation_id")
+    or "prompts" (a list of {prompt, variation_id}), an optional "job_id" that
+    is echoed back, and optional overrides for JOB_OPTIONS.
+    """
+    job_id = None
+    try:
+        job = orjson.loads(line)
+        if not isinstance(job, dict):
+            raise ValueError("Each job must be a JSON object")
+        job_id = job.get("job_id")
+        
+        overrides = {key: job[key] for key in JOB_OPTIONS if key in job}
+        validate_job_options(overrides, args.concurrency)
+        job_args = argparse.Namespace(**{**vars(args), **overrides})
+        
+        batch = "prompts" in job
+        if batch:
+            prompts = parse_prompt_entries(job["prompts"])
+        elif job.get("prompt"):
+            prompts = [(job["prompt"], str(job.get("variation_id") or "A"))]
+        else:
+            raise ValueError("Job must include 'prompt' or 'prompts'")
+        
+        results = await run(generator, uploader, client, prompts, job_args, cache, semaphore)
+        output = format_output(results, batch)
+    except Exception as e:
+        logger.error(f"Job failed: {e}")
+        output = {"success": False, "error": str(e)}
+    
+    if job_id is not None:
+        output["job_id"] = job_id
+    return output
+
+
+async def serve(
+    generator: GeminiImageGenerator,
+    uploader: ImageKitUploader,
+    args: argparse.Namespace,
+    cache: Optional[PromptCache] = None
+) -> None:
+    """
+    Read JSONL jobs from stdin and write one JSONL result per job to stdout
+    
+    Up to --max-jobs jobs run at once over the same clients, so results are
+    written as they finish and may come back out of order; send a job_id to
+    match them up. All jobs share one --concurrency cap on Gemini requests.
+    """
+    sem = asyncio.Semaphore(args.max_jobs)
+    gemini_sem = asyncio.Semaphore(args.concurrency)
+    tasks = set()
+    
+    async def _run_job(client: "httpx.AsyncClient", line: str) -> None:
+        try:
+            output = await handle_job(generator, uploader, client, line, args, cache, gemini_sem)
+        finally:
+            sem.release()
+        emit(output)
+    
+    async with _new_async_imagekit_client() as client:
+        while True:
+            line = await asyncio.to_thread(sys.stdin.readline)
+            if not line:
+                break
+            if not line.strip():
+                continue
+            
+            await sem.acquire()
+            task = asyncio.create_task(_run_job(client, line))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        
+        # Drain in-flight jobs before the client closes
+        await asyncio.gather(*tasks)
 
 
 def main():
@@ -182,56 +832,95 @@ def main():
     parser = argparse.ArgumentParser(
         description="Generate images using Google Gemini API and upload to ImageKit"
     )
-    parser.add_argument("--prompt", type=str, required=True, help="Text prompt for image generation")
+    prompt_group = parser.add_mutually_exclusive_group()
+    prompt_group.add_argument("--prompt", type=str, help="Text prompt for image generation")
+    prompt_group.add_argument(
+        "--prompts-json",
+        type=str,
+        help='JSON array of {"prompt": ..., "variation_id": ...} objects to generate concurrently'
+    )
+    prompt_group.add_argument(
+        "--serve",
+        "--server",
+        dest="server",
+        action="store_true",
+        help="Run as a long-lived worker: read JSONL jobs on stdin, write JSONL results on stdout"
+    )
     parser.add_argument("--variation", type=str, default="A", choices=["A", "B"], help="Variation identifier")
     parser.add_argument("--model", type=str, default="gemini-2.5-flash-image", help="Gemini model to use")
-    parser.add_argument("--aspect-ratio", type=str, default="1:1", choices=["1:1", "3:4", "4:3", "9:16", "16:9"])
+    parser.add_argument("--aspect-ratio", type=str, default="1:1", choices=ASPECT_RATIOS)
+    parser.add_argument(
+        "--output-mime-type",
+        type=str,
+        choices=["image/png", "image/jpeg"],
+        help="Image format to request; JPEG is much smaller (Vertex AI only)"
+    )
     parser.add_argument("--campaign-id", type=str, default="default", help="Campaign ID for folder organization")
+    parser.add_argument("--concurrency", type=positive_int, default=2, help="Maximum concurrent Gemini requests, shared by all jobs in --serve mode")
+    parser.add_argument(
+        "--max-jobs",
+        type=positive_int,
+        default=4,
+        help="Maximum jobs processed concurrently in --serve mode"
+    )
+    parser.add_argument(
+        "--cache-file",
+        type=str,
+        help="JSON file for the approximate prompt cache; similar prompts reuse earlier uploads"
+    )
+    parser.add_argument(
+        "--embedding-model",
+        type=str,
+        default=EMBEDDING_MODEL,
+        help="Gemini embedding model used for prompt cache lookups"
+    )
+    parser.add_argument(
+        "--cache-threshold",
+        type=float,
+        default=DEFAULT_CACHE_THRESHOLD,
+        help="Minimum cosine similarity for a prompt cache hit"
+    )
     
     args = parser.parse_args()
+    if not (args.prompt or args.prompts_json or args.server):
+        parser.error("one of the arguments --prompt --prompts-json --serve is required")
     
     try:
         # Initialize clients
-        generator = GeminiImageGenerator()
+        generator = GeminiImageGenerator(output_mime_type=args.output_mime_type)
         uploader = ImageKitUploader()
+        cache = None
+        if args.cache_file:
+            cache = PromptCache(
+                args.cache_file,
+                _get_gemini_client(generator.api_key),
+                threshold=args.cache_threshold,
+                embedding_model=args.embedding_model
+            )
         
-        # Generate image
-        image_bytes, mime_type = generator.generate_image(
-            prompt=args.prompt,
-            model=args.model,
-            aspect_ratio=args.aspect_ratio
-        )
-        
-        # Generate unique filename
-        ext = "png" if "png" in mime_type else "jpg"
-        filename = f"ad_{args.campaign_id}_{args.variation}_{uuid.uuid4().hex[:8]}.{ext}"
-        
-        # Upload to ImageKit
-        folder = f"ad-images/{args.campaign_id}"
-        upload_result = uploader.upload(image_bytes, filename, folder)
-        
-        # Output JSON result
-        result = {
-            "success": True,
-            "variation_id": args.variation,
-            "image_url": upload_result["url"],
-            "thumbnail_url": upload_result.get("thumbnail_url"),
-            "file_id": upload_result["file_id"],
-            "mime_type": mime_type,
-            "prompt_used": args.prompt
-        }
+        if args.server:
+            asyncio.run(serve(generator, uploader, args, cache))
+            sys.exit(0)
         
-        print(json.dumps(result, indent=2))
-        sys.exit(0)
+        prompts = load_prompts(args)
+        results = asyncio.run(run_once(generator, uploader, prompts, args, cache))
         
     except Exception as e:
         logger.error(f"Script execution failed: {e}")
-        print(json.dumps({
-            "success": False,
-            "error": str(e),
-            "variation_id": args.variation
-        }))
+        error = {"success": False, "error": str(e)}
+        if args.prompts_json is not None:
+            # Batch failures are not tied to one variation; keep the batch shape
+            error["variations"] = []
+        elif not args.server:
+            error["variation_id"] = args.variation
+        emit(error)
         sys.exit(1)
+    
+    output = format_output(results, batch=args.prompts_json is not None)
+    
+    # Output JSON result
+    emit(output, indent=True)
+    sys.exit(0 if output["success"] else 1)
 
 
 if __name__ == "__main__":